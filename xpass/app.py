@@ -12,15 +12,20 @@ import matplotlib.pyplot as plt
 from xpass.utils import plot_pass
 from xpass.loading import get_passes_preprocessed
 from xpass.params import *
-from xpass.model import load_model
+from xpass.model import get_model, list_models, model_cache
+from xpass.similarity import get_situation_index
 
 from mplsoccer import Pitch
 
 
 # ------ INITIALIZE ------
 
-if "model" not in st.session_state:
-    st.session_state["model"] = load_model()
+if "models" not in st.session_state:
+    model_cache.preload()
+    st.session_state["models"] = list_models()
+
+# The index is loaded once per process (and kept when a new pass is picked)
+situation_index = get_situation_index()
 
 if "demo" not in st.session_state:
     demo_file = os.path.join(PROJECT_HOME, "data", f"demo_{GENDER}_{SIZE}.csv")
@@ -90,6 +95,13 @@ with st.sidebar:
         st.experimental_rerun()
 
 
+    st.subheader("Pick the models:")
+    model_names = st.session_state["models"]["name"].tolist()
+    if not model_names:
+        st.warning(f"No model found in the registry ({os.path.join(PROJECT_HOME, 'data', 'models')}).")
+    default_models = [name for name in [f"model_{SIZE}"] if name in model_names] or model_names[:1]
+    selected_models = st.multiselect("Models to compare", model_names, default = default_models)
+
     st.subheader("Change the pass parameters:")
 
     teams = ["Teammates", "Opponents"]
@@ -173,38 +185,45 @@ with st.sidebar:
         # sample_pass_preprocessed = get_passes_preprocessed(st.session_state["sample_pass_init"])
         # pass_preprocessed = get_passes_preprocessed(pass_df)
 
-        outcome = st.session_state["model"].predict(pass_df)
         outcome_map = {0 : "incomplete pass", 1 : "succesful pass"}
-        outcome = outcome_map[outcome[0]]
+        predictions = []
 
-        proba = st.session_state["model"].predict_proba(pass_df)
-        proba = round(100 * proba[0][1], 1)
+        for model_name in selected_models:
 
-        # col1, col2 = st.columns(2)
-        # col1.write("Outcome prediction:")
-        # col1.write(f"{outcome}")
+            model = get_model(model_name)
 
-        # col2.write("Success probability:")
+            outcome = model.predict(pass_df)
+            outcome = outcome_map[outcome[0]]
 
-        # col2.write(f"{proba}%")
+            proba = model.predict_proba(pass_df)
+            proba = round(100 * proba[0][1], 1)
 
-        st.dataframe(
-            pd.DataFrame.from_dict(
-                [{
-                    "Outcome prediction" : f"{outcome}",
-                    "Success probability" : f"{proba}%"
-                }]
-            )
-        )
+            predictions.append({
+                "Model" : model_name,
+                "Outcome prediction" : f"{outcome}",
+                "Success probability" : f"{proba}%"
+            })
+
+        st.dataframe(pd.DataFrame.from_dict(predictions))
 
 
 # st.write(f"Pass length: {pass_length}")
 # st.write(f"Pass angle: {pass_angle}")
 # st.write(f"Freeze frame: {str(freeze_frame)}")
 
+st.subheader("Models")
+st.dataframe(st.session_state["models"])
+
 st.subheader("Model input")
 st.dataframe(pass_df)
 
+st.subheader("Similar passes")
+if situation_index is None:
+    st.write("The similar passes index was not built yet (see xpass.similarity.get_situation_index).")
+else:
+    k = st.slider("Number of similar passes", 1, 50, value = 10)
+    st.dataframe(situation_index.query(pass_df, k = k))
+
 st.subheader("Pass plot")
 st.dataframe(pass_df)
 fig, ax = plt.subplots()
@@ -0,0 +1,399 @@
+"""Score passes live, as the events and 360 freeze frames of a match arrive.
+
+Both the events and the three-sixty frames are read as newline-delimited json
+(one Statsbomb event or one three-sixty frame per line) from a socket or from
+a file that is being appended to. A local replay tool streams a historical match
+from the Statsbomb open data folder, to load test the scoring offline.
+
+Usage:
+    python -m xpass.live serve --port 8765
+    python -m xpass.live replay --match-id 3788741 --port 8765 --speed 10
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from xpass.params import THREE_SIXTY, EVENTS
+
+
+MODEL_COLUMNS = [
+    "location_x", "location_y", "play_pattern_name", "pass_angle",
+    "pass_height_id", "pass_body_part_name", "freeze_frame", "pass_end_location"
+]
+
+
+def event_to_pass_row(event: dict, frame: dict) -> dict:
+    """Build the model input of a pass from its raw Statsbomb event
+    and three-sixty frame.
+
+    Inputs:
+        event (dict): The Statsbomb pass event
+        frame (dict): The three-sixty frame of the pass
+
+    Returns:
+        A dictionnary with the model input columns"""
+
+    pass_ = event["pass"]
+
+    row = {
+        "location_x" : event["location"][0],
+        "location_y" : event["location"][1],
+        "play_pattern_name" : event.get("play_pattern", {}).get("name", np.nan),
+        "pass_angle" : pass_["angle"],
+        "pass_height_id" : pass_.get("height", {}).get("id", np.nan),
+        "pass_body_part_name" : pass_.get("body_part", {}).get("name", np.nan),
+        "freeze_frame" : frame["freeze_frame"],
+        "pass_end_location" : pass_["end_location"]
+    }
+
+    return row
+
+
+def get_period_time(event: dict) -> float:
+    """Return the time of a Statsbomb event since the start of its period, in seconds."""
+    hours, minutes, seconds = event["timestamp"].split(":")
+    return 3600 * int(hours) + 60 * int(minutes) + float(seconds)
+
+
+class LatencyStats:
+    """Rolling statistics of the scoring latency (in seconds)
+    over the last `window` scored passes."""
+
+    def __init__(self, budget: float = 0.5, window: int = 1000):
+        self.budget = budget
+        self.latencies = deque(maxlen = window)
+        self.n_scored = 0
+        self.n_over_budget = 0
+
+
+    def record(self, latency: float):
+        self.latencies.append(latency)
+        self.n_scored += 1
+        if latency > self.budget:
+            self.n_over_budget += 1
+
+    def summary(self) -> dict:
+        if not self.latencies:
+            return {"n_scored" : 0}
+
+        latencies_ms = 1000 * np.array(self.latencies)
+
+        return {
+            "n_scored" : self.n_scored,
+            "n_over_budget" : self.n_over_budget,
+            "p50_ms" : round(float(np.percentile(latencies_ms, 50)), 1),
+            "p95_ms" : round(float(np.percentile(latencies_ms, 95)), 1),
+            "max_ms" : round(float(latencies_ms.max()), 1)
+        }
+
+
+class LiveScorer:
+    """Match pass events with their three-sixty frames and score them
+    with the model in small batches.
+
+    Matched passes go through a bounded queue: when the model cannot keep up,
+    the queue fills up and the readers stop reading their socket or file
+    until a batch has been scored (backpressure).
+
+    Inputs:
+        model: A fitted pipeline with a predict_proba method
+        batch_size (int): The maximum number of passes scored at once
+        batch_timeout (float): The maximum time to wait for a batch to fill up, in seconds
+        max_wait (float): The maximum time to wait for the frame of an event
+            (or the event of a frame), in seconds. Unmatched messages are then dropped.
+        queue_size (int): The maximum number of passes waiting to be scored
+        seen_size (int): The number of recent non-pass event ids kept to drop their frames
+        latency_budget (float): The target latency per pass, in seconds
+        emit: A callable that receives each prediction (a dictionnary).
+            Default value is None, i.e. print the predictions as json lines.
+    """
+
+    def __init__(
+        self, model, batch_size: int = 16, batch_timeout: float = 0.05,
+        max_wait: float = 2.0, queue_size: int = 256, latency_budget: float = 0.5,
+        seen_size: int = 10000, emit = None):
+        self.model = model
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.max_wait = max_wait
+        self.seen_size = seen_size
+        self.emit = emit or (lambda prediction: print(json.dumps(prediction), flush = True))
+
+        self.queue = asyncio.Queue(maxsize = queue_size)
+        self.stats = LatencyStats(budget = latency_budget)
+        self.pending_events = {}
+        self.pending_frames = {}
+        # Three-sixty frames are also published for carries, receipts... which are not scored
+        self.non_passes = OrderedDict()
+        self.n_expired = 0
+
+
+    async def handle(self, message: dict):
+        """Handle one event or three-sixty frame message."""
+        now = time.monotonic()
+
+        if "event_uuid" in message:
+            uuid = message["event_uuid"]
+            if uuid in self.pending_events:
+                event, first_seen = self.pending_events.pop(uuid)
+                await self.queue.put((event, message, first_seen, now))
+            elif uuid not in self.non_passes:
+                self.pending_frames[uuid] = (message, now)
+
+        elif message.get("type", {}).get("name") == "Pass":
+            uuid = message["id"]
+            if uuid in self.pending_frames:
+                frame, first_seen = self.pending_frames.pop(uuid)
+                await self.queue.put((message, frame, first_seen, now))
+            else:
+                self.pending_events[uuid] = (message, now)
+
+        elif "id" in message:
+            self.pending_frames.pop(message["id"], None)
+            self.non_passes[message["id"]] = None
+            if len(self.non_passes) > self.seen_size:
+                self.non_passes.popitem(last = False)
+
+    async def consume(self, lines):
+        """Handle every json line of an (async) iterator of lines."""
+        async for line in lines:
+            line = line.strip()
+            if line:
+                await self.handle(json.loads(line))
+
+    async def expire(self):
+        """Drop the events and frames that waited longer than max_wait for their match.
+        Only the passes that lost their frame are counted in n_expired."""
+        while True:
+            await asyncio.sleep(self.max_wait / 2)
+            deadline = time.monotonic() - self.max_wait
+            for pending in [self.pending_events, self.pending_frames]:
+                expired = [uuid for uuid, (_, first_seen) in pending.items() if first_seen < deadline]
+                for uuid in expired:
+                    del pending[uuid]
+                if pending is self.pending_events:
+                    self.n_expired += len(expired)
+
+    async def score(self):
+        """Score the matched passes in batches, as they come."""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_timeout
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+
+            pass_df = pd.DataFrame(
+                [event_to_pass_row(event, frame) for event, frame, _, _ in batch],
+                columns = MODEL_COLUMNS)
+
+            # The model is run in a thread, so that the readers keep filling the queue meanwhile
+            probas = await loop.run_in_executor(None, self.model.predict_proba, pass_df)
+
+            scored_at = time.monotonic()
+            for (event, _, first_seen, matched), proba in zip(batch, probas):
+                latency = scored_at - matched
+                self.stats.record(latency)
+                self.emit({
+                    "event_uuid" : event["id"],
+                    "success_probability" : round(float(proba[1]), 4),
+                    "latency_ms" : round(1000 * latency, 1),
+                    "wait_ms" : round(1000 * (matched - first_seen), 1)
+                })
+                self.queue.task_done()
+
+    async def run(self, *sources):
+        """Consume the sources of lines until they are exhausted,
+        then score the remaining passes."""
+
+        async def consume_all():
+            await asyncio.gather(*[self.consume(source) for source in sources])
+            await self.queue.join()
+
+        score_task = asyncio.create_task(self.score())
+        expire_task = asyncio.create_task(self.expire())
+        consume_task = asyncio.create_task(consume_all())
+        try:
+            # score() only returns by raising (e.g. the model failed): stop consuming then
+            await asyncio.wait([consume_task, score_task], return_when = asyncio.FIRST_COMPLETED)
+            if score_task.done():
+                score_task.result()
+            consume_task.result()
+        finally:
+            for task in [score_task, expire_task, consume_task]:
+                task.cancel()
+
+        return self.summary()
+
+    def summary(self) -> dict:
+        return dict(
+            self.stats.summary(), n_expired = self.n_expired,
+            n_pending = len(self.pending_events) + len(self.pending_frames))
+
+
+async def read_lines(reader: asyncio.StreamReader):
+    """Yield the lines of a socket until it is closed."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        yield line.decode()
+
+
+async def tail_file(path: str, poll_interval: float = 0.1, idle_timeout: float = None):
+    """Yield the lines of a file as they are appended to it.
+
+    Inputs:
+        path (str): The path of the file
+        poll_interval (float): The time between two reads at the end of the file, in seconds
+        idle_timeout (float): Stop when nothing was appended for that long, in seconds.
+            Default value is None, i.e. follow the file forever.
+    """
+    with open(path) as f:
+        buffer = ""
+        idle_since = time.monotonic()
+        while True:
+            chunk = f.readline()
+            if chunk:
+                idle_since = time.monotonic()
+                buffer += chunk
+                if buffer.endswith("\n"):
+                    yield buffer
+                    buffer = ""
+            else:
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                await asyncio.sleep(poll_interval)
+
+
+async def serve(scorer: LiveScorer, host: str = "127.0.0.1", port: int = 8765):
+    """Score the passes streamed by every client connected to host:port."""
+    tasks = [asyncio.create_task(scorer.score()), asyncio.create_task(scorer.expire())]
+
+    async def handle_client(reader, writer):
+        await scorer.consume(read_lines(reader))
+        writer.close()
+        print(json.dumps(scorer.summary()), file = sys.stderr, flush = True)
+
+    server = await asyncio.start_server(handle_client, host, port)
+    serve_task = asyncio.create_task(server.serve_forever())
+    try:
+        # Stop serving if the scorer fails, instead of filling the queue forever
+        await asyncio.wait([serve_task, tasks[0]], return_when = asyncio.FIRST_COMPLETED)
+        if tasks[0].done():
+            tasks[0].result()
+        serve_task.result()
+    finally:
+        serve_task.cancel()
+        server.close()
+        for task in tasks:
+            task.cancel()
+
+
+async def replay_match(match_id: int, speed: float = 1.0, frame_delay: float = 0.1):
+    """Yield the events and three-sixty frames of a historical match as json lines,
+    in the order of the events and at the pace of the match.
+
+    Inputs:
+        match_id (int): The Statsbomb match id
+        speed (float): The replay speed (2 means twice as fast as the match).
+            Set to 0 to replay as fast as possible.
+        frame_delay (float): The delay between an event and its frame, in match seconds
+    """
+
+    with open(os.path.join(EVENTS, f"{match_id}.json")) as f:
+        events = sorted(json.load(f), key = lambda event: event["index"])
+
+    with open(os.path.join(THREE_SIXTY, f"{match_id}.json")) as f:
+        frames = {frame["event_uuid"] : frame for frame in json.load(f)}
+
+    # Frames are sent a little after their event, as in a live feed.
+    # The clock restarts at each period, so the pace is only computed within a period.
+    messages = []
+    for event in events:
+        period_time = get_period_time(event)
+        messages.append((event["period"], period_time, event))
+        if event["id"] in frames:
+            messages.append((event["period"], period_time + frame_delay, frames[event["id"]]))
+
+    previous_period, previous_time = None, 0
+    for period, period_time, message in messages:
+        if speed and period == previous_period:
+            await asyncio.sleep(max(0, period_time - previous_time) / speed)
+        previous_period, previous_time = period, period_time
+        yield json.dumps(message) + "\n"
+
+
+async def replay_to_socket(match_id: int, host: str, port: int, speed: float = 1.0):
+    reader, writer = await asyncio.open_connection(host, port)
+    async for line in replay_match(match_id, speed = speed):
+        writer.write(line.encode())
+        # drain() waits while the scorer applies backpressure
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def replay_to_file(match_id: int, path: str, speed: float = 1.0):
+    with open(path, "a") as f:
+        async for line in replay_match(match_id, speed = speed):
+            f.write(line)
+            f.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Live scoring of passes")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    serve_parser = subparsers.add_parser("serve", help = "score the passes of a socket or a file")
+    serve_parser.add_argument("--host", default = "127.0.0.1")
+    serve_parser.add_argument("--port", type = int, default = 8765)
+    serve_parser.add_argument("--file", help = "tail this file instead of listening on a socket")
+    serve_parser.add_argument("--idle-timeout", type = float, default = None)
+    serve_parser.add_argument("--batch-size", type = int, default = 16)
+    serve_parser.add_argument("--max-wait", type = float, default = 2.0)
+    serve_parser.add_argument("--queue-size", type = int, default = 256)
+    serve_parser.add_argument("--latency-budget", type = float, default = 0.5)
+
+    replay_parser = subparsers.add_parser("replay", help = "stream a historical match")
+    replay_parser.add_argument("--match-id", type = int, required = True)
+    replay_parser.add_argument("--speed", type = float, default = 1.0)
+    replay_parser.add_argument("--host", default = "127.0.0.1")
+    replay_parser.add_argument("--port", type = int, default = 8765)
+    replay_parser.add_argument("--output", help = "append to this file instead of a socket")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        from xpass.model import load_model
+
+        scorer = LiveScorer(
+            load_model(), batch_size = args.batch_size, max_wait = args.max_wait,
+            queue_size = args.queue_size, latency_budget = args.latency_budget)
+
+        if args.file:
+            summary = asyncio.run(scorer.run(tail_file(args.file, idle_timeout = args.idle_timeout)))
+            print(json.dumps(summary), file = sys.stderr)
+        else:
+            asyncio.run(serve(scorer, args.host, args.port))
+
+    elif args.output:
+        asyncio.run(replay_to_file(args.match_id, args.output, speed = args.speed))
+    else:
+        asyncio.run(replay_to_socket(args.match_id, args.host, args.port, speed = args.speed))
+
+
+if __name__ == "__main__":
+    main()
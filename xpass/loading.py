@@ -2,55 +2,175 @@
 
 import os
 
+import glob
 import json
+import random
+from datetime import datetime
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from sklearn.model_selection import train_test_split
 
-from xpass.params import PROJECT_HOME, STATSBOMB_DATA, THREE_SIXTY, MATCHES, EVENTS, GENDER, SIZE, SIZE_MAP
+from xpass.params import PROJECT_HOME, STATSBOMB_DATA, THREE_SIXTY, MATCHES, EVENTS, GENDER, SIZE, SIZE_MAP, SEED
 from xpass.utils import return_as_list
 
 
-def get_data():
-    pass
+MATCH_COLUMNS_ORIGIN = [
+    "match_date", "competition_competition_name", "home_team_home_team_gender",
+    "home_team_home_team_name", "away_team_away_team_name",
+    "competition_competition_id", "season_season_id", "season_season_name"
+]
+
+MATCH_COLUMNS_DESTINATION = [
+    "match_date", "competition_name", "gender",
+    "home_team_name", "away_team_name",
+    "competition_id", "season_id", "season_name"
+]
+
+PASSES_COLUMNS = [
+    "id", "match_date", "competition_id", "competition_name", "gender",
+    "season_id", "season_name",
+    "home_team_name", "away_team_name",
+    "index", "period", "timestamp", "minute", "second",
+    "possession", "duration", "type_id", "type_name",
+    "possession_team_id", "possession_team_name", "play_pattern_id",
+    "play_pattern_name", "team_id", "team_name", "related_events",
+    "location", "player_id", "player_name", "position_id",
+    "position_name", "pass_recipient_id", "pass_recipient_name",
+    "pass_length", "pass_angle", "pass_height_id", "pass_height_name",
+    "pass_end_location", "pass_body_part_id", "pass_body_part_name",
+    "pass_type_id", "pass_type_name", "pass_cross", "pass_outcome_id",
+    "pass_outcome_name", "under_pressure", "pass_assisted_shot_id",
+    "pass_shot_assist", "off_camera", "pass_deflected", "counterpress",
+    "pass_aerial_won", "pass_switch", "out", "pass_outswinging",
+    "pass_technique_id", "pass_technique_name", "pass_cut_back",
+    "pass_goal_assist", "pass_through_ball", "pass_miscommunication",
+    "match_id", "pass_no_touch", "pass_straight", "pass_inswinging"
+    ]
+
+EXCLUDED_OUTCOMES = ["Unknown", "Injury Clearance"]
+FAILURE_OUTCOMES = ["Incomplete", "Out", "Pass Offside"]
+
+CONTEXT_COLUMNS = [
+    "possession_pass_number", "possession_elapsed", "prev_pass_length",
+    "prev_pass_angle", "prev_pass_success", "time_since_opponent_event"
+]
+CONTEXT_INPUT_COLUMNS = [
+    "id", "match_id", "index", "period", "minute", "second", "timestamp", "possession",
+    "team_id", "type_name", "pass_length", "pass_angle", "pass_outcome_name"
+]
+
+PASSES_STORE = os.path.join(PROJECT_HOME, "data", "passes")
+# Files starting with "_" are ignored by pyarrow when reading the store
+COMPLETE_MARKER = "_COMPLETE"
+PARTITION_COLUMNS = ["gender", "competition_id", "season_id"]
+
+# Every file of the passes store is written with the same schema
+STORE_NUMERIC_COLUMNS = [
+    "index", "period", "minute", "second", "possession", "duration", "type_id",
+    "possession_team_id", "play_pattern_id", "team_id", "player_id", "position_id",
+    "pass_recipient_id", "pass_length", "pass_angle", "pass_height_id",
+    "pass_body_part_id", "pass_type_id", "pass_outcome_id", "pass_technique_id"
+] + CONTEXT_COLUMNS
+STORE_ID_COLUMNS = ["match_id", "competition_id", "season_id"]
+STORE_BOOLEAN_COLUMNS = [
+    "pass_cross", "under_pressure", "pass_shot_assist", "off_camera", "pass_deflected",
+    "counterpress", "pass_aerial_won", "pass_switch", "out", "pass_outswinging",
+    "pass_cut_back", "pass_goal_assist", "pass_through_ball", "pass_miscommunication",
+    "pass_no_touch", "pass_straight", "pass_inswinging"
+]
+FRAMES_COLUMNS = ["event_uuid", "visible_area", "freeze_frame"]
+
+# The ingestion manifest is kept at the root of the store it describes
+MANIFEST_NAME = "_manifest.json"
+
+
+def get_data(refresh: bool = False) -> pd.DataFrame:
+    """Get the passes of GENDER from the partitioned passes store
+    (built on the first call), sampled according to SIZE.
+
+    The store is read on every call (only the partitions of GENDER and the columns
+    of the passes). Only the S and M samples are cached, and drawn again
+    when the store was refreshed since.
 
+    Inputs:
+        refresh (bool): Ingest the matches published or modified since the last call.
+            Default value is False.
+
+    Returns:
+        A pandas DataFrame with the passes and their associated freeze frames"""
+
+    if SIZE not in ["S", "M", "L"]:
+        raise Exception(f"{SIZE} should be either 'S', 'M' or 'L'")
+
+    if refresh or not is_passes_store_complete():
+        refresh_passes_store()
+
+    columns = PASSES_COLUMNS + CONTEXT_COLUMNS + FRAMES_COLUMNS
+
+    if SIZE == "L":
+        return read_passes(gender = GENDER, columns = columns)
+
+    # The passes of the store have more columns than the ones of get_passes: use another file
+    csv_file = os.path.join(PROJECT_HOME, "data", f"store_passes_{GENDER}_{SIZE}.csv")
+    manifest_file = os.path.join(PASSES_STORE, MANIFEST_NAME)
+
+    if os.path.isfile(csv_file) and os.path.getmtime(csv_file) >= os.path.getmtime(manifest_file):
+        return pd.read_csv(csv_file)
+
+    passes = read_passes(gender = GENDER, columns = columns)
+    passes = passes.sample(SIZE_MAP[SIZE], random_state = SEED).reset_index(drop = True)
+    passes.to_csv(csv_file, index = False)
 
-def get_competitions() -> pd.DataFrame:
+    return passes
+
+
+def get_competitions(gender: str = GENDER, refresh: bool = False) -> pd.DataFrame:
     """Get a DataFrame with the list of competitions available in Statsbomb
     open data.
 
+    Inputs:
+        gender (str): "MALE", "FEMALE" or "ALL". Default value is GENDER.
+        refresh (bool): Read the open data folder again instead of the cached file.
+            Default value is False.
+
     Returns:
         A pandas DataFrame"""
 
-    csv_file = os.path.join(PROJECT_HOME, "data", f"competitions_{GENDER}.csv")
+    csv_file = os.path.join(PROJECT_HOME, "data", f"competitions_{gender}.csv")
 
-    if os.path.isfile(csv_file):
+    if os.path.isfile(csv_file) and not refresh:
         competitions = pd.read_csv(csv_file)
 
     else:
         competitions = pd.read_json(os.path.join(STATSBOMB_DATA, "competitions.json"))
         competitions = competitions[~competitions["match_available_360"].isnull()]
 
-        if GENDER.lower() in ["male", "female"]:
-            competitions = competitions[competitions["competition_gender"] == GENDER.lower()]
+        if gender.lower() in ["male", "female"]:
+            competitions = competitions[competitions["competition_gender"] == gender.lower()]
 
         competitions.to_csv(csv_file, index = False)
 
     return competitions
 
 
-def get_matches(competitions_df: pd.DataFrame) -> pd.DataFrame:
+def get_matches(competitions_df: pd.DataFrame, gender: str = GENDER, refresh: bool = False) -> pd.DataFrame:
     """Get a DataFrame with the list of matches available in Statsbomb open data.
 
     Inputs:
         competitions_df: A pd.DataFrame with a list of competitions
+        gender (str): The gender of the competitions, used to name the cached file.
+            Default value is GENDER.
+        refresh (bool): Read the open data folder again instead of the cached file.
+            Default value is False.
 
     Returns:
         A pandas DataFrame"""
 
-    csv_file = os.path.join(PROJECT_HOME, "data", f"matches_{GENDER}.csv")
+    csv_file = os.path.join(PROJECT_HOME, "data", f"matches_{gender}.csv")
 
-    if os.path.isfile(csv_file):
+    if os.path.isfile(csv_file) and not refresh:
         matches = pd.read_csv(csv_file)
 
     else:
@@ -74,6 +194,26 @@ def get_matches(competitions_df: pd.DataFrame) -> pd.DataFrame:
     return matches
 
 
+def add_match_info(events_df: pd.DataFrame, matches_df: pd.DataFrame) -> pd.DataFrame:
+    """Add the match information (date, competition, gender, teams)
+    to a DataFrame of events.
+
+    Inputs:
+        events_df: A pd.DataFrame with a list of events and a match_id column
+        matches_df: A pd.DataFrame with a list of matches
+
+    Returns:
+        The events pd.DataFrame with the match information columns"""
+
+    match_info = matches_df[["match_id"] + MATCH_COLUMNS_ORIGIN].drop_duplicates("match_id")
+    match_info.columns = ["match_id"] + MATCH_COLUMNS_DESTINATION
+
+    events_df = events_df.drop(columns = MATCH_COLUMNS_DESTINATION, errors = "ignore")
+    events_df = events_df.merge(match_info, how = "left", on = "match_id")
+
+    return events_df
+
+
 def get_frames_and_events(matches_df: pd.DataFrame) -> tuple:
     """Get a tuple of DataFrame with the freeze frames and events
     in a list of matches.
@@ -132,20 +272,7 @@ def get_frames_and_events(matches_df: pd.DataFrame) -> tuple:
 
         events = pd.concat(events_df_ls).reset_index(drop = True)
 
-        col_origin = [
-            "match_date", "competition_competition_name", "home_team_home_team_gender",
-            "home_team_home_team_name", "away_team_away_team_name",
-        ]
-
-        col_destination = [
-            "match_date", "competition_name", "gender",
-            "home_team_name", "away_team_name"
-        ]
-
-        events[col_destination] = events.apply(
-            lambda x : matches_df[matches_df["match_id"] == x["match_id"]].iloc[0][col_origin],
-            axis = 1, result_type = "expand"
-        )
+        events = add_match_info(events, matches_df)
 
         frames.to_csv(csv_file_frames, index = False)
         events.to_csv(csv_file_events, index = False)
@@ -166,44 +293,30 @@ def get_passes(events_df: pd.DataFrame, frames_df: pd.DataFrame) -> pd.DataFrame
 
     csv_file = os.path.join(PROJECT_HOME, "data", f"passes_{GENDER}_{SIZE}.csv")
 
+    passes = None
     if os.path.isfile(csv_file):
         passes = pd.read_csv(csv_file)
+        # Files cached before the possession context was added: build them again
+        if not set(CONTEXT_COLUMNS).issubset(passes.columns):
+            passes = None
 
-    else:
+    if passes is None:
 
         passes = events_df[events_df["type_name"] == "Pass"].reset_index(drop = True)
 
-        columns_to_keep = [
-            "id", "match_date", "competition_name", "gender",
-            "home_team_name", "away_team_name",
-            "index", "period", "timestamp", "minute", "second",
-            "possession", "duration", "type_id", "type_name",
-            "possession_team_id", "possession_team_name", "play_pattern_id",
-            "play_pattern_name", "team_id", "team_name", "related_events",
-            "location", "player_id", "player_name", "position_id",
-            "position_name", "pass_recipient_id", "pass_recipient_name",
-            "pass_length", "pass_angle", "pass_height_id", "pass_height_name",
-            "pass_end_location", "pass_body_part_id", "pass_body_part_name",
-            "pass_type_id", "pass_type_name", "pass_cross", "pass_outcome_id",
-            "pass_outcome_name", "under_pressure", "pass_assisted_shot_id",
-            "pass_shot_assist", "off_camera", "pass_deflected", "counterpress",
-            "pass_aerial_won", "pass_switch", "out", "pass_outswinging",
-            "pass_technique_id", "pass_technique_name", "pass_cut_back",
-            "pass_goal_assist", "pass_through_ball", "pass_miscommunication",
-            "match_id", "pass_no_touch", "pass_straight", "pass_inswinging"
-            ]
-
-        passes = passes[columns_to_keep]
+        passes = passes.reindex(columns = PASSES_COLUMNS)
 
         passes = passes.merge(
             frames_df, how = "left", left_on = "id", right_on = "event_uuid")
 
         passes = passes[~passes["freeze_frame"].isnull()]
-        passes = passes[~passes["pass_outcome_name"].isin(["Unknown", "Injury Clearance"])]
+        passes = passes[~passes["pass_outcome_name"].isin(EXCLUDED_OUTCOMES)]
+
+        passes = passes.merge(get_possession_context(events_df), how = "left", on = "id")
 
         if SIZE in ["S", "M"]:
             n_rows = SIZE_MAP[SIZE]
-            passes = passes.sample(n_rows).reset_index(drop = True)
+            passes = passes.sample(n_rows, random_state = SEED).reset_index(drop = True)
         elif SIZE == "L":
             pass
         else:
@@ -214,6 +327,409 @@ def get_passes(events_df: pd.DataFrame, frames_df: pd.DataFrame) -> pd.DataFrame
     return passes
 
 
+def get_possession_context(events_df: pd.DataFrame) -> pd.DataFrame:
+    """Get the possession context of each pass of a DataFrame of events:
+    the number of passes so far in the possession, the time elapsed since the start
+    of the possession, the length, angle and success of the previous pass
+    of the possession and the time since the last event of the opponents
+    in the same period.
+
+    The features are computed with group operations on the events sorted by
+    match and index, so the whole events DataFrame is processed at once.
+
+    Inputs:
+        events_df (pd.DataFrame): A pd.DataFrame of events (all types, not only passes)
+
+    Returns:
+        A pandas DataFrame with an id column and the possession context columns"""
+
+    events = events_df.reindex(columns = CONTEXT_INPUT_COLUMNS).sort_values(["match_id", "index"])
+
+    # The timestamp restarts at each period, unlike minute which restarts at 45, 90...
+    # whatever the stoppage time of the previous period (same clock as live.get_period_time)
+    clock = events["timestamp"].astype(str).str.split(":", expand = True).astype(float)
+    events["time"] = 3600 * clock[0] + 60 * clock[1] + clock[2]
+
+    possessions = events.groupby(["match_id", "possession"], sort = False)["time"]
+    events["possession_elapsed"] = events["time"] - possessions.transform("first")
+
+    # Time of the last event of each of the two teams of the match, carried forward
+    # within the period only
+    team_rank = events.groupby("match_id")["team_id"].rank(method = "dense")
+    last_event = pd.DataFrame({
+        "team_1" : events["time"].where(team_rank == 1),
+        "team_2" : events["time"].where(team_rank == 2)
+    }).groupby([events["match_id"], events["period"]]).ffill()
+    opponent_last_event = last_event["team_2"].where(team_rank == 1, last_event["team_1"])
+    events["time_since_opponent_event"] = events["time"] - opponent_last_event
+
+    passes = events[events["type_name"] == "Pass"].copy()
+    passes["success"] = (~passes["pass_outcome_name"].isin(FAILURE_OUTCOMES)).astype(float)
+
+    pass_groups = passes.groupby(["match_id", "possession"], sort = False)
+    passes["possession_pass_number"] = pass_groups.cumcount()
+    previous = pass_groups[["pass_length", "pass_angle", "success"]].shift(1)
+    passes["prev_pass_length"] = previous["pass_length"]
+    passes["prev_pass_angle"] = previous["pass_angle"]
+    passes["prev_pass_success"] = previous["success"]
+
+    return passes[["id"] + CONTEXT_COLUMNS].reset_index(drop = True)
+
+
+def get_context_events(events: list, match_id: int) -> pd.DataFrame:
+    """Get a light DataFrame of the events of a match (as loaded from the events
+    json file), with only the columns needed by get_possession_context."""
+
+    return pd.DataFrame([
+        {
+            "id" : event["id"],
+            "match_id" : match_id,
+            "index" : event["index"],
+            "period" : event["period"],
+            "minute" : event["minute"],
+            "second" : event["second"],
+            "timestamp" : event["timestamp"],
+            "possession" : event["possession"],
+            "team_id" : event["team"]["id"],
+            "type_name" : event["type"]["name"],
+            "pass_length" : event.get("pass", {}).get("length"),
+            "pass_angle" : event.get("pass", {}).get("angle"),
+            "pass_outcome_name" : event.get("pass", {}).get("outcome", {}).get("name")
+        }
+        for event in events
+    ], columns = CONTEXT_INPUT_COLUMNS)
+
+
+def get_match_passes(match_id: int, matches_df: pd.DataFrame) -> pd.DataFrame:
+    """Get a DataFrame with the passes of a single match and their freeze frames.
+
+    Inputs:
+        match_id (int): The Statsbomb match id
+        matches_df (pd.DataFrame): A pd.DataFrame with a list of matches
+
+    Returns:
+        A pandas DataFrame, or None if the match has no 360 data"""
+
+    frames_file = os.path.join(THREE_SIXTY, f"{match_id}.json")
+    events_file = os.path.join(EVENTS, f"{match_id}.json")
+    if not (os.path.isfile(frames_file) and os.path.isfile(events_file)):
+        return None
+
+    with open(events_file) as f:
+        events = pd.json_normalize(json.load(f), sep = "_")
+    with open(frames_file) as f:
+        frames = pd.json_normalize(json.load(f), sep = "_")
+
+    events["match_id"] = match_id
+    events = add_match_info(events, matches_df)
+
+    passes = events[events["type_name"] == "Pass"].reindex(columns = PASSES_COLUMNS)
+    passes = passes.merge(
+        frames.reindex(columns = FRAMES_COLUMNS), how = "left", left_on = "id", right_on = "event_uuid")
+
+    passes = passes[~passes["freeze_frame"].isnull()]
+    passes = passes[~passes["pass_outcome_name"].isin(EXCLUDED_OUTCOMES)]
+
+    passes = passes.merge(get_possession_context(events), how = "left", on = "id")
+
+    return passes.reset_index(drop = True)
+
+
+def to_store_schema(passes_df: pd.DataFrame) -> pd.DataFrame:
+    """Cast a DataFrame of passes to the schema of the passes store.
+    Lists and dictionnaries (locations, freeze frames...) are stored as strings,
+    exactly as in the csv files."""
+
+    passes = passes_df.reindex(columns = PASSES_COLUMNS + CONTEXT_COLUMNS + FRAMES_COLUMNS)
+
+    for col in passes.columns:
+        if col in STORE_ID_COLUMNS:
+            passes[col] = passes[col].astype("int64")
+        elif col in STORE_NUMERIC_COLUMNS:
+            passes[col] = pd.to_numeric(passes[col]).astype("float64")
+        elif col in STORE_BOOLEAN_COLUMNS:
+            passes[col] = passes[col].astype("boolean")
+        else:
+            passes[col] = passes[col].map(
+                lambda x : str(x) if isinstance(x, (list, dict)) or not pd.isna(x) else None
+            ).astype("string")
+
+    passes["gender"] = passes["gender"].str.lower()
+
+    return passes
+
+
+def write_passes_store(passes_df: pd.DataFrame, path: str = PASSES_STORE):
+    """Write passes to the store, partitioned by gender, competition and season,
+    with one file per match.
+
+    Inputs:
+        passes_df (pd.DataFrame): A pd.DataFrame of passes
+        path (str): The root directory of the store"""
+
+    passes = to_store_schema(passes_df)
+
+    for match_id, match_passes in passes.groupby("match_id"):
+        table = pa.Table.from_pandas(match_passes, preserve_index = False)
+        pq.write_to_dataset(
+            table, root_path = path, partition_cols = PARTITION_COLUMNS,
+            basename_template = f"{match_id}-{{i}}.parquet",
+            existing_data_behavior = "overwrite_or_ignore"
+        )
+
+
+def get_file_signature(file: str) -> list:
+    """Return the [size, modification time] of a file, or None if it does not exist."""
+    if not os.path.isfile(file):
+        return None
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(path: str = PASSES_STORE) -> dict:
+    """Load the ingestion manifest of a passes store, i.e. the signature of the events
+    and three-sixty files of each match already in the store."""
+    manifest_file = os.path.join(path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, path: str = PASSES_STORE):
+    manifest_file = os.path.join(path, MANIFEST_NAME)
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, manifest_file)
+
+
+def delete_match_passes(match_id: int, path: str = PASSES_STORE):
+    """Delete the file(s) of a match from the passes store."""
+    for file in glob.glob(os.path.join(path, "**", f"{match_id}-*.parquet"), recursive = True):
+        os.remove(file)
+
+
+def refresh_passes_store(path: str = PASSES_STORE, full: bool = False) -> list:
+    """Ingest the matches that were published or modified since the last refresh
+    in the partitioned passes store. The files of the untouched matches are not rewritten.
+
+    Inputs:
+        path (str): The root directory of the store
+        full (bool): Ignore the manifest and ingest every match again. Default value is False.
+
+    Returns:
+        The list of the ingested match ids"""
+
+    competitions = get_competitions(gender = "ALL", refresh = True)
+    matches = get_matches(competitions, gender = "ALL", refresh = True)
+
+    os.makedirs(path, exist_ok = True)
+    manifest = {} if full else load_manifest(path)
+    ingested = []
+
+    try:
+        for match_id in matches["match_id"].unique():
+
+            signature = {
+                "events" : get_file_signature(os.path.join(EVENTS, f"{match_id}.json")),
+                "three_sixty" : get_file_signature(os.path.join(THREE_SIXTY, f"{match_id}.json"))
+            }
+
+            # Matches without 360 data yet will be ingested when it is published
+            if None in signature.values() or manifest.get(str(match_id)) == signature:
+                continue
+
+            # A modified match may now have fewer (or no) passes: remove its previous file
+            delete_match_passes(match_id, path = path)
+
+            passes = get_match_passes(match_id, matches)
+            if len(passes) > 0:
+                write_passes_store(passes, path = path)
+
+            manifest[str(match_id)] = signature
+            ingested.append(match_id)
+
+        # Only mark the store as complete when every match was ingested
+        with open(os.path.join(path, COMPLETE_MARKER), "w") as f:
+            f.write(datetime.now().isoformat(timespec = "seconds"))
+
+    finally:
+        save_manifest(manifest, path)
+
+    return ingested
+
+
+def is_passes_store_complete(path: str = PASSES_STORE) -> bool:
+    """Tell if the passes store was fully built (and not interrupted half-way)."""
+    return os.path.isfile(os.path.join(path, COMPLETE_MARKER))
+
+
+def build_passes_store(path: str = PASSES_STORE):
+    """Ingest the passes of all the competitions with 360 data (male and female)
+    in the partitioned passes store, one match at a time, from an empty manifest.
+
+    Inputs:
+        path (str): The root directory of the store"""
+
+    refresh_passes_store(path = path, full = True)
+
+
+def read_passes(
+    gender: str = GENDER, competitions: list = None, seasons: list = None,
+    columns: list = None, filters: list = None, path: str = PASSES_STORE) -> pd.DataFrame:
+    """Read passes from the partitioned passes store.
+    Only the partitions matching the filters and the requested columns are read.
+
+    Inputs:
+        gender (str): "MALE", "FEMALE" or "ALL". Default value is GENDER.
+        competitions (list): The competition ids to read. Default value is None (all).
+        seasons (list): The season ids to read. Default value is None (all).
+        columns (list): The columns to read. Default value is None (all).
+        filters (list): Additional pyarrow filters, e.g. [("season_name", ">=", "2020")].
+            Default value is None.
+        path (str): The root directory of the store
+
+    Returns:
+        A pandas DataFrame of passes"""
+
+    predicates = []
+    if gender and gender.lower() in ["male", "female"]:
+        predicates.append(("gender", "=", gender.lower()))
+    if competitions is not None:
+        predicates.append(("competition_id", "in", list(competitions)))
+    if seasons is not None:
+        predicates.append(("season_id", "in", list(seasons)))
+    predicates += filters or []
+
+    passes = pd.read_parquet(
+        path, engine = "pyarrow", columns = columns, filters = predicates or None)
+
+    # Partition columns are read as categories
+    for col in PARTITION_COLUMNS:
+        if col in passes.columns:
+            passes[col] = passes[col].astype(str if col == "gender" else "int64")
+
+    return passes
+
+
+def is_candidate_pass(event: dict) -> bool:
+    """Tell if a raw Statsbomb event (as loaded from the events json file)
+    is a pass that can be kept in the passes dataset.
+
+    Inputs:
+        event (dict): A Statsbomb event
+
+    Returns:
+        True if the event is a pass with a usable outcome"""
+
+    if event["type"]["name"] != "Pass":
+        return False
+
+    outcome = event.get("pass", {}).get("outcome", {}).get("name")
+    return outcome not in EXCLUDED_OUTCOMES
+
+
+def get_passes_sample(matches_df: pd.DataFrame, n_rows: int = None, seed: int = SEED) -> pd.DataFrame:
+    """Get a DataFrame with a random sample of passes, streaming through
+    the matches instead of building the full events and freeze frames datasets.
+
+    The passes are selected with reservoir sampling: each match is read once,
+    and only the events and freeze frames of the selected passes are normalized.
+    The sample is reproducible for a given seed.
+
+    Inputs:
+        matches_df (pd.DataFrame): A pd.DataFrame with a list of matches
+        n_rows (int): The number of passes to sample.
+            Default value is None, i.e. the number of rows matching SIZE.
+        seed (int): The seed of the random generator
+
+    Returns:
+        A pandas DataFrame with the sampled passes and their associated freeze frames"""
+
+    csv_file = os.path.join(PROJECT_HOME, "data", f"passes_{GENDER}_{SIZE}.csv")
+
+    passes = None
+    if os.path.isfile(csv_file):
+        passes = pd.read_csv(csv_file)
+        # Files cached before the possession context was added: build them again
+        if not set(CONTEXT_COLUMNS).issubset(passes.columns):
+            passes = None
+
+    if passes is None:
+
+        if n_rows is None:
+            if SIZE not in ["S", "M"]:
+                raise Exception(f"{SIZE} should be either 'S' or 'M' to sample the passes")
+            n_rows = SIZE_MAP[SIZE]
+
+        rng = random.Random(seed)
+        reservoir = []
+        n_seen = 0
+
+        for match_id in matches_df["match_id"].unique():
+
+            frames_file = os.path.join(THREE_SIXTY, f"{match_id}.json")
+            events_file = os.path.join(EVENTS, f"{match_id}.json")
+            if not (os.path.isfile(frames_file) and os.path.isfile(events_file)):
+                continue
+
+            with open(events_file) as f:
+                match_events = json.load(f)
+            candidates = [event for event in match_events if is_candidate_pass(event)]
+
+            if not candidates:
+                continue
+
+            with open(frames_file) as f:
+                frames = {frame["event_uuid"] : frame for frame in json.load(f)}
+
+            # The possession context is computed from the events already in memory,
+            # only for the matches with at least one selected pass
+            context = None
+
+            for event in candidates:
+
+                frame = frames.get(event["id"])
+                if frame is None or frame.get("freeze_frame") is None:
+                    continue
+
+                n_seen += 1
+                if len(reservoir) < n_rows:
+                    i = len(reservoir)
+                    reservoir.append(None)
+                else:
+                    i = rng.randrange(n_seen)
+                    if i >= n_rows:
+                        continue
+
+                if context is None:
+                    context = get_possession_context(
+                        get_context_events(match_events, match_id)).set_index("id").to_dict("index")
+                reservoir[i] = (match_id, event, frame, context[event["id"]])
+
+        if not reservoir:
+            raise Exception("No pass with a freeze frame was found in the matches")
+
+        events = pd.json_normalize([event for _, event, _, _ in reservoir], sep = "_")
+        events["match_id"] = [match_id for match_id, _, _, _ in reservoir]
+        events = add_match_info(events, matches_df)
+        events = events.reindex(columns = PASSES_COLUMNS)
+        events[CONTEXT_COLUMNS] = pd.DataFrame(
+            [context for _, _, _, context in reservoir], columns = CONTEXT_COLUMNS).to_numpy()
+
+        frames = pd.json_normalize([frame for _, _, frame, _ in reservoir], sep = "_")
+
+        passes = events.merge(
+            frames, how = "left", left_on = "id", right_on = "event_uuid")
+
+        passes = passes.sample(frac = 1, random_state = seed).reset_index(drop = True)
+
+        passes.to_csv(csv_file, index = False)
+
+    return passes
+
+
 def split_dataset(
     passes_df: pd.DataFrame, test_size: float,
     calibration_size: float, demo_size: float) -> tuple:
@@ -271,7 +787,9 @@ def split_dataset(
     return splitting
 
 
-def get_passes_preprocessed(passes_df: pd.DataFrame, dataset: str = None, balance_ratio: int = None) -> pd.DataFrame:
+def get_passes_preprocessed(
+    passes_df: pd.DataFrame, dataset: str = None, balance_ratio: int = None,
+    context: bool = False) -> pd.DataFrame:
     """Returns the DataFrame of passes for ML pipeline
 
     Inputs:
@@ -280,6 +798,7 @@ def get_passes_preprocessed(passes_df: pd.DataFrame, dataset: str = None, balanc
         balance_ratio (int): The ratio between the number of sucessful and unsuccesful passes.
             Default ratio is None. Set a ratio of 1 for exact same number of sucessful
             and unsuccesful passes. Set to "None" to keep imbalanced data.
+        context (bool): Keep the possession context features. Default value is False.
 
     Returns:
         A preprocessed passes pd.DataFrame
@@ -288,23 +807,36 @@ def get_passes_preprocessed(passes_df: pd.DataFrame, dataset: str = None, balanc
 
     csv_file = os.path.join(PROJECT_HOME, "data", f"{dataset}_preprocessed_{GENDER}_{SIZE}.csv")
 
+    useful_col = [
+        "location_x", "location_y", "play_pattern_name",
+        "pass_angle", "pass_height_id", "pass_body_part_name",
+        "freeze_frame", "pass_end_location", "success"]
+
+    if context:
+        useful_col = useful_col[:-1] + CONTEXT_COLUMNS + ["success"]
+        missing = [col for col in CONTEXT_COLUMNS if col not in passes_df.columns]
+        if missing:
+            raise ValueError(
+                f"The passes have no possession context ({', '.join(missing)}): "
+                f"delete the cached passes file to build it again with the context")
+
+    passes_preprocessed = None
     if os.path.isfile(csv_file):
         passes_preprocessed = pd.read_csv(csv_file)
+        # Files cached by a previous version may lack some columns: build them again
+        if set(useful_col).issubset(passes_preprocessed.columns):
+            passes_preprocessed = passes_preprocessed[useful_col]
+        else:
+            passes_preprocessed = None
 
-    else:
+    if passes_preprocessed is None:
         passes_preprocessed = passes_df.copy()
         passes_preprocessed["location"] = passes_preprocessed["location"].map(return_as_list)
         passes_preprocessed["location_x"] = passes_preprocessed["location"].map(lambda x : x[0])
         passes_preprocessed["location_y"] = passes_preprocessed["location"].map(lambda x : x[1])
 
         # passes_df[~passes_df["pass_outcome_name"].isin(["Unknown", "Injury Clearance"])]
-        failure = ["Incomplete", "Out", "Pass Offside"]
-        passes_preprocessed["success"] = passes_preprocessed["pass_outcome_name"].map(lambda x: int(x not in failure))
-
-        useful_col = [
-            "location_x", "location_y", "play_pattern_name",
-            "pass_angle", "pass_height_id", "pass_body_part_name",
-            "freeze_frame", "success"]
+        passes_preprocessed["success"] = passes_preprocessed["pass_outcome_name"].map(lambda x: int(x not in FAILURE_OUTCOMES))
 
         passes_preprocessed = passes_preprocessed[useful_col]
 
@@ -1,12 +1,174 @@
 import os
+import json
 import pickle
+import warnings
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+import pandas as pd
+
+from xpass.params import SIZE, GENDER, PROJECT_HOME, MODEL_CACHE_MB, MODEL_PRELOAD
+
+MODELS_DIR = os.path.join(PROJECT_HOME, "data", "models")
 
-from xpass.params import SIZE, PROJECT_HOME
 
 def load_model(
-    path: str = os.path.join(PROJECT_HOME, "data", "models"),
+    path: str = MODELS_DIR,
     model_name: str = f"model_{SIZE}.pkl"
     ):
     model_path = os.path.join(path, model_name)
     model = pickle.load(open(model_path,"rb"))
     return model
+
+
+def save_model(model, name: str, metadata: dict = None, path: str = MODELS_DIR) -> str:
+    """Save a model in the registry, with a json file of metadata next to it.
+
+    Inputs:
+        model: The fitted model
+        name (str): The name of the model (the file is saved as {name}.pkl)
+        metadata (dict): The metadata of the model, e.g. training config,
+            feature set and metrics. GENDER and SIZE are added by default.
+
+    Returns:
+        The path of the saved model"""
+
+    os.makedirs(path, exist_ok = True)
+    model_path = os.path.join(path, f"{name}.pkl")
+
+    with open(model_path, "wb") as f:
+        pickle.dump(model, f)
+
+    metadata = dict({"gender" : GENDER, "size" : SIZE}, **(metadata or {}))
+    metadata["name"] = name
+    metadata["created_at"] = datetime.now().isoformat(timespec = "seconds")
+
+    with open(os.path.join(path, f"{name}.json"), "w") as f:
+        json.dump(metadata, f, indent = 2, default = str)
+
+    return model_path
+
+
+def get_model_metadata(name: str, path: str = MODELS_DIR) -> dict:
+    """Return the metadata of a model of the registry
+    (only its name and file size if it was saved without metadata)."""
+
+    metadata = {"name" : name}
+    metadata_file = os.path.join(path, f"{name}.json")
+    if os.path.isfile(metadata_file):
+        with open(metadata_file) as f:
+            metadata.update(json.load(f))
+    metadata["file_size"] = os.path.getsize(os.path.join(path, f"{name}.pkl"))
+
+    return metadata
+
+
+def list_models(path: str = MODELS_DIR) -> pd.DataFrame:
+    """Get a DataFrame with the models of the registry and their metadata."""
+
+    names = []
+    if os.path.isdir(path):
+        names = sorted(file[:-len(".pkl")] for file in os.listdir(path) if file.endswith(".pkl"))
+
+    if not names:
+        return pd.DataFrame(columns = ["name", "file_size"])
+
+    return pd.DataFrame([get_model_metadata(name, path) for name in names])
+
+
+class ModelCache:
+    """Process-wide cache of the models of the registry.
+
+    Models are loaded on demand and the least recently used ones are evicted
+    when the total size of the cached models exceeds max_bytes.
+    The size of a model is estimated with the size of its pickle file.
+
+    Inputs:
+        max_bytes (int): The memory cap of the cache
+        path (str): The path of the registry
+    """
+
+    def __init__(self, max_bytes: int, path: str = MODELS_DIR):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.models = OrderedDict()
+        self.sizes = {}
+        self.lock = threading.RLock()
+        self.loading_locks = {}
+
+
+    def _get_cached(self, name: str):
+        with self.lock:
+            if name in self.models:
+                self.models.move_to_end(name)
+                return self.models[name]
+        return None
+
+    def get(self, name: str):
+        """Return a model, loading it if it is not in the cache.
+
+        Models are unpickled outside of the cache lock, so that cached models
+        are served while another model is loading. A lock per model name
+        prevents loading the same model twice."""
+        model = self._get_cached(name)
+        if model is not None:
+            return model
+
+        with self.lock:
+            loading_lock = self.loading_locks.setdefault(name, threading.Lock())
+
+        with loading_lock:
+            # The model may have been loaded by another thread meanwhile
+            model = self._get_cached(name)
+            if model is not None:
+                return model
+
+            model = load_model(path = self.path, model_name = f"{name}.pkl")
+            size = os.path.getsize(os.path.join(self.path, f"{name}.pkl"))
+
+            with self.lock:
+                self.models[name] = model
+                self.sizes[name] = size
+                self._evict()
+                self.loading_locks.pop(name, None)
+
+            return model
+
+    def _evict(self):
+        # Always keep the most recently used model, even if it exceeds the cap on its own
+        while len(self.models) > 1 and sum(self.sizes.values()) > self.max_bytes:
+            name, _ = self.models.popitem(last = False)
+            del self.sizes[name]
+
+    def warm_up(self, names: list):
+        """Load a set of models, the last one being the most recently used."""
+        for name in names:
+            self.get(name)
+
+    def preload(self):
+        """Load the hot set of models listed in MODEL_PRELOAD.
+        Names missing from the registry are skipped with a warning."""
+        names = [name.strip() for name in MODEL_PRELOAD if name.strip()]
+        missing = [name for name in names if not os.path.isfile(os.path.join(self.path, f"{name}.pkl"))]
+        if missing:
+            warnings.warn(f"Models not found in {self.path}, not preloaded: {', '.join(missing)}")
+        self.warm_up([name for name in names if name not in missing])
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+            self.sizes.clear()
+
+    def cached(self) -> list:
+        """Return the names of the cached models, from least to most recently used."""
+        with self.lock:
+            return list(self.models)
+
+
+model_cache = ModelCache(max_bytes = MODEL_CACHE_MB * 1024 ** 2)
+
+
+def get_model(name: str = f"model_{SIZE}"):
+    """Return a model of the registry from the process-wide cache."""
+    return model_cache.get(name)
@@ -1,6 +1,7 @@
 import os
 
 PROJECT_HOME = os.environ.get("PROJECT_HOME")
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(PROJECT_HOME, "data", "cache"))
 
 STATSBOMB_DATA = os.environ.get("STATSBOMB_DATA")
 THREE_SIXTY = os.path.join(STATSBOMB_DATA, "three-sixty")
@@ -15,5 +16,10 @@ SIZE_MAP = {
     "M" : int(os.environ.get("SIZE_M"))
 }
 
+SEED = int(os.environ.get("SEED", 42))
+
+MODEL_CACHE_MB = int(os.environ.get("MODEL_CACHE_MB", 1024))
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "").split(",")
+
 if __name__ == "__main__":
     print(GENDER)
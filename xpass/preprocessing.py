@@ -1,9 +1,11 @@
 import os
 import json
+import joblib
+import numpy as np
 import pandas as pd
 
-from xpass.params import STATSBOMB_DATA, THREE_SIXTY, MATCHES, EVENTS, GENDER
-from xpass.utils import get_reception_shape_features
+from xpass.params import STATSBOMB_DATA, THREE_SIXTY, MATCHES, EVENTS, GENDER, CACHE_DIR
+from xpass.utils import get_reception_shape_features, get_freeze_frame_arrays, get_pitch_control, return_as_list, parse_freeze_frame
 
 # from sklearn.preprocessing import FunctionTransformer
 
@@ -11,17 +13,82 @@ from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import make_pipeline
 from sklearn.compose import make_column_transformer, make_column_selector
-from sklearn.base import TransformerMixin, BaseEstimator
+from sklearn.base import TransformerMixin, BaseEstimator, clone
+
+
+RECEPTION_INPUT_COLUMNS = ["location_x", "location_y", "pass_angle", "freeze_frame"]
+PITCH_CONTROL_COLUMNS = ["pc_end", "pc_corridor_mean", "pc_corridor_min", "pc_pitch"]
+RECEPTION_COLUMNS = ["n_teammates", "n_opponents"]
+
+
+def get_reception_columns(corr_width: float = 2, alpha: float = 10, length: float = 50) -> list:
+    """Return the names of the reception features precomputed for a set
+    of reception shape parameters, e.g. ["n_teammates_2_10_50", "n_opponents_2_10_50"]."""
+    return [f"{col}_{corr_width:g}_{alpha:g}_{length:g}" for col in RECEPTION_COLUMNS]
+
+
+def get_reception_features(
+    X: pd.DataFrame,
+    corr_width: float = 2,
+    alpha: float = 10,
+    length: float = 50,
+    memory: str = None) -> np.ndarray:
+    """Get the number of teammates and opponents within the reception shape
+    of each pass of a DataFrame.
+
+    When a memory directory is given, the result is cached on disk, keyed on
+    the passes (rows and index) and the reception shape parameters, and returned
+    as a read-only memory-mapped array. In a cross validation, the features are
+    computed once per fold and per set of parameters, then reused by the other
+    candidates of the search. The freeze frames are still sent to each worker:
+    use precompute_reception_features to keep them out of the workers.
+
+    Inputs:
+        X (pd.DataFrame): The passes, with location_x, location_y, pass_angle
+            and freeze_frame columns
+        corr_width (float): the with of the central corridor in yards
+        alpha (float): the angle of the reception shape in degrees
+        length (float): the length of the reception shape in yards
+        memory (str): The path of the cache directory. Default value is None (no caching).
+
+    Returns:
+        A (n_passes, 2) np.ndarray with the number of teammates and opponents"""
+
+    if memory is not None:
+        key = joblib.hash((X[RECEPTION_INPUT_COLUMNS], corr_width, alpha, length))
+        cache_file = os.path.join(memory, f"reception_{key}.npy")
+        if os.path.isfile(cache_file):
+            return np.load(cache_file, mmap_mode = "r")
+
+    features = np.array([
+        get_reception_shape_features(
+            row, corr_width = corr_width, alpha = alpha, length = length)
+        for _, row in X[RECEPTION_INPUT_COLUMNS].iterrows()
+    ], dtype = np.float64).reshape(-1, 2)
+
+    if memory is not None:
+        os.makedirs(memory, exist_ok = True)
+        # Write to a temporary file first, so that concurrent workers never read a partial array
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, features)
+        os.replace(tmp_file, cache_file)
+        features = np.load(cache_file, mmap_mode = "r")
+
+    return features
 
 
 class ReceptionTransformer(TransformerMixin, BaseEstimator):
     # BaseEstimator generates the get_params() and set_params() methods that all Pipelines require
     # TransformerMixin creates the fit_transform() method from fit() and transform()
 
-    def __init__(self, corr_width: float = 2, alpha: float = 10, length: float = 50):
+    def __init__(
+        self, corr_width: float = 2, alpha: float = 10, length: float = 50,
+        memory: str = None):
         self.corr_width = corr_width
         self.alpha = alpha
         self.length = length
+        self.memory = memory
 
 
     def fit(self, X, y = None):
@@ -32,17 +99,166 @@ class ReceptionTransformer(TransformerMixin, BaseEstimator):
     def transform(self, X, y = None):
         # Return the result as a DataFrame for an integration into the ColumnTransformer
 
-        X[["n_teammates", "n_opponents"]] = X.apply(
-            lambda x: get_reception_shape_features(
-                x, corr_width = self.corr_width, alpha = self.alpha, length = self.length),
-            axis = 1, result_type = "expand"
-        )
+        # The end location is only used by the PitchControlTransformer
+        X = X.drop(columns = "pass_end_location", errors = "ignore")
+
+        if "freeze_frame" in X.columns:
+            # Models pickled before the memory parameter was added don't have the attribute
+            features = get_reception_features(
+                X, corr_width = self.corr_width, alpha = self.alpha,
+                length = self.length, memory = getattr(self, "memory", None))
+            X_transformed = X.drop(columns = "freeze_frame")
+
+        else:
+            # The reception features were precomputed with precompute_reception_features
+            columns = get_reception_columns(self.corr_width, self.alpha, self.length)
+            if not set(columns).issubset(X.columns):
+                raise ValueError(
+                    f"The reception features were not precomputed for corr_width = {self.corr_width}, "
+                    f"alpha = {self.alpha} and length = {self.length}")
+            features = X[columns].to_numpy()
+            precomputed = [col for col in X.columns if col.startswith(tuple(f"{c}_" for c in RECEPTION_COLUMNS))]
+            X_transformed = X.drop(columns = precomputed)
+
+        X_transformed[RECEPTION_COLUMNS] = features
+
+        return X_transformed
 
-        X_transformed = X.drop(columns = "freeze_frame")
 
+class ReceptionFeatures(TransformerMixin, BaseEstimator):
+    """Return the reception features as a np.ndarray (a read-only memory-mapped
+    array when memory is set), to be used on the RECEPTION_INPUT_COLUMNS
+    in a ColumnTransformer."""
+
+    def __init__(
+        self, corr_width: float = 2, alpha: float = 10, length: float = 50,
+        memory: str = None):
+        self.corr_width = corr_width
+        self.alpha = alpha
+        self.length = length
+        self.memory = memory
+
+
+    def fit(self, X, y = None):
+        return self
+
+    def transform(self, X, y = None):
+        return get_reception_features(
+            X, corr_width = self.corr_width, alpha = self.alpha,
+            length = self.length, memory = self.memory)
+
+
+class FreezeFrameParser(TransformerMixin, BaseEstimator):
+    """Parse the freeze_frame strings once, so that the next transformers
+    of the pipeline (pitch control, reception shape) reuse the parsed lists."""
+
+    def fit(self, X, y = None):
+        return self
+
+    def transform(self, X, y = None):
+        X_transformed = X.copy()
+        X_transformed["freeze_frame"] = X_transformed["freeze_frame"].map(parse_freeze_frame)
         return X_transformed
 
 
+class PitchControlTransformer(TransformerMixin, BaseEstimator):
+    """Add pitch control features, computed from an approximate pitch control
+    surface of each freeze frame evaluated on a coarse grid:
+    the attacking team control at the pass end location (pc_end),
+    its mean and minimum along the pass corridor (pc_corridor_mean, pc_corridor_min)
+    and over the whole pitch (pc_pitch).
+
+    The passes are processed by tiles of tile_size passes, so that the memory
+    used by the (passes, players, grid points) arrays stays bounded.
+    The freeze_frame column is kept for the ReceptionTransformer, the
+    pass_end_location column is dropped."""
+
+    def __init__(
+        self, grid_step: float = 4, max_speed: float = 5.0, reaction_time: float = 0.7,
+        sigma: float = 0.45, n_corridor: int = 10, tile_size: int = 512):
+        self.grid_step = grid_step
+        self.max_speed = max_speed
+        self.reaction_time = reaction_time
+        self.sigma = sigma
+        self.n_corridor = n_corridor
+        self.tile_size = tile_size
+
+
+    def fit(self, X, y = None):
+        return self
+
+    def transform(self, X, y = None):
+
+        xs = np.arange(self.grid_step / 2, 120, self.grid_step)
+        ys = np.arange(self.grid_step / 2, 80, self.grid_step)
+        grid = np.stack(np.meshgrid(xs, ys, indexing = "ij"), axis = -1).reshape(-1, 2)
+
+        start = X[["location_x", "location_y"]].to_numpy(dtype = float)
+        end = np.array(X["pass_end_location"].map(return_as_list).tolist(), dtype = float).reshape(-1, 2)
+
+        # Points along the pass corridor, from the passer to the end location
+        steps = np.linspace(0, 1, self.n_corridor)
+        corridor = start[:, None, :] + steps[None, :, None] * (end - start)[:, None, :]
+        points = np.concatenate([end[:, None, :], corridor], axis = 1)
+
+        # Index of the grid cell of each point
+        ix = np.clip((points[:, :, 0] // self.grid_step).astype(int), 0, len(xs) - 1)
+        iy = np.clip((points[:, :, 1] // self.grid_step).astype(int), 0, len(ys) - 1)
+        cells = ix * len(ys) + iy
+
+        freeze_frames = X["freeze_frame"].tolist()
+        features = np.empty((len(X), 4))
+
+        for i in range(0, len(X), self.tile_size):
+            locations, teammates = get_freeze_frame_arrays(freeze_frames[i:i + self.tile_size])
+            control = get_pitch_control(
+                locations, teammates, grid, max_speed = self.max_speed,
+                reaction_time = self.reaction_time, sigma = self.sigma)
+
+            control_points = np.take_along_axis(control, cells[i:i + self.tile_size], axis = 1)
+            features[i:i + self.tile_size, 0] = control_points[:, 0]
+            features[i:i + self.tile_size, 1] = control_points[:, 1:].mean(axis = 1)
+            features[i:i + self.tile_size, 2] = control_points[:, 1:].min(axis = 1)
+            features[i:i + self.tile_size, 3] = control.mean(axis = 1)
+
+        X_transformed = X.drop(columns = "pass_end_location")
+        X_transformed[PITCH_CONTROL_COLUMNS] = features
+
+        return X_transformed
+
+
+def precompute_reception_features(
+    X: pd.DataFrame,
+    params: list = None,
+    memory: str = None) -> pd.DataFrame:
+    """Replace the freeze_frame column of a DataFrame of passes by the reception
+    shape features, so that the freeze frames are neither recomputed for each fold
+    nor copied to each worker during cross validation and hyperparameters search.
+
+    The features are computed for each set of reception shape parameters and
+    stored in columns named after the parameters (see get_reception_columns).
+    The ReceptionTransformer picks the columns matching its own parameters,
+    and raises an error if they were not precomputed.
+
+    Inputs:
+        X (pd.DataFrame): The passes, with a freeze_frame column
+        params (list): A list of dictionnaries of reception shape parameters
+            (corr_width, alpha, length). Default value is None, i.e. the default parameters.
+        memory (str): The path of the cache directory. Default value is None (no caching).
+
+    Returns:
+        A pd.DataFrame without the freeze_frame column, ready for the pipeline"""
+
+    X_precomputed = X.drop(columns = ["freeze_frame", "pass_end_location"], errors = "ignore")
+
+    for shape_params in params or [{}]:
+        shape_params = dict({"corr_width" : 2, "alpha" : 10, "length" : 50}, **shape_params)
+        X_precomputed[get_reception_columns(**shape_params)] = get_reception_features(
+            X, memory = memory, **shape_params)
+
+    return X_precomputed
+
+
 num_col = make_column_selector(dtype_include=["float64", "int64"])
 num_tranformer = make_pipeline(
     SimpleImputer(strategy = "mean"),
@@ -64,3 +280,23 @@ pipeline = make_pipeline(
     ReceptionTransformer(),
     preprocessing
 )
+
+# Same features, with the reception features cached in CACHE_DIR as memory-mapped
+# arrays, computed once per fold and per set of reception shape parameters.
+# The reception features are counts and never missing, so they are only scaled.
+feature_cat_col = make_column_selector(
+    pattern = "^(?!freeze_frame$|pass_end_location$)", dtype_include = ["object"])
+
+cached_pipeline = make_column_transformer(
+    (make_pipeline(ReceptionFeatures(memory = CACHE_DIR), MinMaxScaler()), RECEPTION_INPUT_COLUMNS),
+    (clone(num_tranformer), num_col),
+    (clone(cat_transformer), feature_cat_col)
+)
+
+# Reception shape and pitch control features
+pitch_control_pipeline = make_pipeline(
+    FreezeFrameParser(),
+    PitchControlTransformer(),
+    ReceptionTransformer(),
+    clone(preprocessing)
+)
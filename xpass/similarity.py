@@ -0,0 +1,168 @@
+"""Retrieve the historical passes most similar to a given situation."""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from sklearn.neighbors import NearestNeighbors
+
+from xpass.params import PROJECT_HOME, GENDER, SIZE
+from xpass.utils import get_freeze_frame_arrays, return_as_list
+
+
+# Bins of the players positions in the pass-aligned frame, in yards:
+# u goes along the pass direction, v across it
+U_BINS = np.arange(-30, 61, 10)
+V_BINS = np.arange(-30, 31, 10)
+
+METADATA_COLUMNS = [
+    "id", "match_date", "competition_name", "home_team_name", "away_team_name",
+    "team_name", "player_name", "pass_outcome_name"
+]
+
+INDEX_FILE = os.path.join(PROJECT_HOME, "data", f"situation_index_{GENDER}_{SIZE}.pkl")
+
+
+def get_situation_embedding(passes_df: pd.DataFrame, pass_weight: float = 2.0, tile_size: int = 4096) -> np.ndarray:
+    """Embed each pass into a fixed-length vector that does not depend
+    on the order of the players in the freeze frame.
+
+    The players positions are expressed in the frame of the pass (origin on
+    the passer, first axis along the pass angle) and counted on a grid,
+    separately for teammates and opponents. The location and direction
+    of the pass are appended to the counts.
+
+    Inputs:
+        passes_df (pd.DataFrame): The passes, with location (or location_x and location_y),
+            pass_angle and freeze_frame columns
+        pass_weight (float): The weight of the pass location and direction in the embedding
+        tile_size (int): The number of passes processed at once
+
+    Returns:
+        A (n_passes, n_features) np.ndarray"""
+
+    if "location_x" in passes_df.columns:
+        start = passes_df[["location_x", "location_y"]].to_numpy(dtype = float)
+    else:
+        start = np.array(passes_df["location"].map(return_as_list).tolist(), dtype = float).reshape(-1, 2)
+    angle = passes_df["pass_angle"].to_numpy(dtype = float)
+    freeze_frames = passes_df["freeze_frame"].tolist()
+
+    n_u, n_v = len(U_BINS) - 1, len(V_BINS) - 1
+    counts = np.zeros((len(passes_df), 2, n_u, n_v), dtype = np.float32)
+
+    for i in range(0, len(passes_df), tile_size):
+        locations, teammates = get_freeze_frame_arrays(freeze_frames[i:i + tile_size])
+        delta = locations - start[i:i + tile_size, None, :]
+        cos = np.cos(angle[i:i + tile_size])[:, None]
+        sin = np.sin(angle[i:i + tile_size])[:, None]
+        u = cos * delta[:, :, 0] + sin * delta[:, :, 1]
+        v = - sin * delta[:, :, 0] + cos * delta[:, :, 1]
+
+        iu = np.digitize(u, U_BINS) - 1
+        iv = np.digitize(v, V_BINS) - 1
+        # Missing players (NaN) and players outside of the grid are not counted
+        inside = (iu >= 0) & (iu < n_u) & (iv >= 0) & (iv < n_v) & ~np.isnan(u)
+
+        rows, players = np.nonzero(inside)
+        channels = np.where(teammates[rows, players], 0, 1)
+        np.add.at(counts, (rows + i, channels, iu[rows, players], iv[rows, players]), 1)
+
+    pass_features = pass_weight * np.column_stack([
+        start[:, 0] / 120, start[:, 1] / 80, np.cos(angle), np.sin(angle)
+    ])
+
+    return np.hstack([counts.reshape(len(passes_df), -1), pass_features])
+
+
+def get_outcomes(passes_df: pd.DataFrame) -> np.ndarray:
+    """Return the actual outcome of each pass, from the pass_outcome_name column
+    (missing for complete passes) or from the success column of preprocessed passes."""
+
+    if "pass_outcome_name" in passes_df.columns:
+        return passes_df["pass_outcome_name"].fillna("Complete").to_numpy()
+    if "success" in passes_df.columns:
+        return np.where(passes_df["success"] == 1, "Complete", "Incomplete")
+
+    raise ValueError("The passes need a pass_outcome_name or a success column")
+
+
+class SituationIndex:
+    """Nearest neighbours index over the situation embeddings of a corpus of passes.
+
+    The embeddings have 2 x 9 x 6 + 4 = 112 dimensions, too many for a ball tree
+    to prune anything: the neighbours are searched by brute force on float32 embeddings.
+    On 300,000 synthetic passes (about the size of the L corpus), a query takes
+    about 55 ms, against about 100 ms with a ball tree (and 7 s to build it).
+
+    Inputs:
+        passes_df (pd.DataFrame): The corpus of passes
+        pass_weight (float): The weight of the pass location and direction in the embedding
+    """
+
+    def __init__(self, passes_df: pd.DataFrame, pass_weight: float = 2.0):
+        self.pass_weight = pass_weight
+        self.neighbors = NearestNeighbors(algorithm = "brute").fit(
+            get_situation_embedding(passes_df, pass_weight = pass_weight).astype(np.float32))
+
+        self.metadata = passes_df.reindex(columns = METADATA_COLUMNS).reset_index(drop = True)
+        self.metadata["pass_outcome_name"] = get_outcomes(passes_df)
+
+
+    def query(self, pass_df: pd.DataFrame, k: int = 10) -> pd.DataFrame:
+        """Return the k passes of the corpus most similar to the first pass of pass_df,
+        with their actual outcome and their distance to the pass."""
+
+        if not hasattr(self, "neighbors"):
+            raise ValueError(
+                "The index was built with a ball tree by a previous version: "
+                "build it again with get_situation_index(passes_df, rebuild = True)")
+
+        embedding = get_situation_embedding(pass_df.iloc[:1], pass_weight = self.pass_weight)
+        distances, indices = self.neighbors.kneighbors(
+            embedding.astype(np.float32), n_neighbors = min(k, len(self.metadata)))
+
+        similar = self.metadata.iloc[indices[0]].reset_index(drop = True)
+        similar.insert(0, "distance", distances[0].round(3))
+
+        return similar
+
+
+# Indexes already loaded by this process, by file
+situation_indexes = {}
+
+
+def get_situation_index(
+    passes_df: pd.DataFrame = None, index_file: str = INDEX_FILE,
+    rebuild: bool = False) -> SituationIndex:
+    """Load the situation index, or build it from a corpus of passes and save it.
+    A loaded index is kept in memory and reused by the next calls of the process.
+
+    Inputs:
+        passes_df (pd.DataFrame): The corpus of passes. Default value is None,
+            i.e. only load an existing index.
+        index_file (str): The path of the index file
+        rebuild (bool): Build the index again from passes_df, even if the file exists
+            (e.g. after a refresh of the passes store). Default value is False.
+
+    Returns:
+        A SituationIndex, or None if there is no index and no corpus to build it"""
+
+    if rebuild and passes_df is None:
+        raise ValueError("passes_df is needed to rebuild the index")
+
+    if rebuild or not os.path.isfile(index_file):
+        if passes_df is None:
+            return None
+        index = SituationIndex(passes_df)
+        with open(index_file, "wb") as f:
+            pickle.dump(index, f)
+        situation_indexes[index_file] = index
+
+    elif index_file not in situation_indexes:
+        with open(index_file, "rb") as f:
+            situation_indexes[index_file] = pickle.load(f)
+
+    return situation_indexes[index_file]
@@ -1,12 +1,19 @@
+import io
+import re
 import ast
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 
 import matplotlib.pyplot as plt
 from matplotlib.path import Path
-from matplotlib.patches import PathPatch
+from matplotlib.patches import PathPatch, Polygon
 from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
 import seaborn as sns
 
 import shapely
@@ -74,8 +81,7 @@ def get_players_within_polygon(freeze_frame: list, reception_shape: shapely.Poly
     n_teammates = 0
     n_opponents = 0
 
-    if isinstance(freeze_frame, str):
-        freeze_frame = ast.literal_eval(freeze_frame)
+    freeze_frame = parse_freeze_frame(freeze_frame)
 
     for player in freeze_frame:
         is_within = all([not player["actor"], reception_shape.contains(
@@ -126,6 +132,117 @@ def get_reception_shape_features(
     return n_teammates, n_opponents
 
 
+FREEZE_FRAME_PLAYER = re.compile(
+    r"'teammate': (True|False), 'actor': (True|False), 'keeper': (True|False), "
+    r"'location': \[([^,\]]+), ([^,\]]+)\]")
+
+
+def parse_freeze_frame(freeze_frame) -> list:
+    """Parse a freeze frame stored as a list-typed string (as in the csv files).
+
+    The players are read with a regular expression, which is much faster than
+    ast.literal_eval on the full dataset. Strings in another format fall back
+    to ast.literal_eval, and lists are returned as is.
+
+    Inputs:
+        freeze_frame (list or str): The Statsbomb freeze frame
+
+    Returns:
+        The freeze frame as a list of dictionnaries
+    """
+
+    if not isinstance(freeze_frame, str):
+        return freeze_frame
+
+    players = FREEZE_FRAME_PLAYER.findall(freeze_frame)
+    if len(players) != freeze_frame.count("{"):
+        return ast.literal_eval(freeze_frame)
+
+    return [
+        {
+            "teammate" : teammate == "True",
+            "actor" : actor == "True",
+            "keeper" : keeper == "True",
+            "location" : [float(x), float(y)]
+        }
+        for teammate, actor, keeper, x, y in players
+    ]
+
+
+def get_freeze_frame_arrays(freeze_frames, max_players: int = 22) -> tuple:
+    """Stack a list of freeze frames into fixed-size arrays.
+
+    Inputs:
+        freeze_frames (list): The Statsbomb freeze frames (lists or list-typed strings)
+        max_players (int): The maximum number of players in a freeze frame
+
+    Returns:
+        A tuple of two np.ndarray (locations, teammates):
+        locations is a (n_frames, max_players, 2) float array, padded with NaN,
+        teammates is a (n_frames, max_players) boolean array
+    """
+
+    locations = np.full((len(freeze_frames), max_players, 2), np.nan, dtype = np.float32)
+    teammates = np.zeros((len(freeze_frames), max_players), dtype = bool)
+
+    players = [parse_freeze_frame(freeze_frame)[:max_players] for freeze_frame in freeze_frames]
+    n_players = np.array([len(frame_players) for frame_players in players], dtype = int)
+    if n_players.sum() == 0:
+        return locations, teammates
+
+    # Fill all the players at once, from flat lists
+    flat = [player for frame_players in players for player in frame_players]
+    rows = np.repeat(np.arange(len(players)), n_players)
+    cols = np.arange(len(flat)) - np.repeat(np.cumsum(n_players) - n_players, n_players)
+    locations[rows, cols] = np.array([player["location"][:2] for player in flat], dtype = np.float32)
+    teammates[rows, cols] = np.array([player["teammate"] for player in flat], dtype = bool)
+
+    return locations, teammates
+
+
+def get_pitch_control(
+    locations: np.ndarray,
+    teammates: np.ndarray,
+    grid: np.ndarray,
+    max_speed: float = 5.0,
+    reaction_time: float = 0.7,
+    sigma: float = 0.45) -> np.ndarray:
+    """Compute an approximate pitch control surface for a batch of freeze frames.
+
+    Each player reaches a point of the pitch after a reaction time, running
+    in straight line at max speed. The control of the attacking team on a point
+    is a logistic function of the difference between the time to arrival
+    of the fastest opponent and of the fastest teammate.
+
+    Inputs:
+        locations (np.ndarray): (n_frames, n_players, 2) players locations, NaN for missing players
+        teammates (np.ndarray): (n_frames, n_players) True for the attacking team
+        grid (np.ndarray): (n_points, 2) points where the control is evaluated
+        max_speed (float): the players speed in yards per second
+        reaction_time (float): the players reaction time in seconds
+        sigma (float): the uncertainty on the time to arrival in seconds
+
+    Returns:
+        A (n_frames, n_points) np.ndarray with the attacking team control, between 0 and 1
+    """
+
+    delta = locations[:, :, None, :] - grid[None, None, :, :].astype(np.float32)
+    time_to_arrival = reaction_time + np.sqrt((delta ** 2).sum(axis = -1)) / max_speed
+
+    # Missing players never arrive
+    missing = np.isnan(locations[:, :, 0])[:, :, None]
+    attack = teammates[:, :, None] & ~missing
+    defence = ~teammates[:, :, None] & ~missing
+    time_attack = np.where(attack, time_to_arrival, np.inf).min(axis = 1)
+    time_defence = np.where(defence, time_to_arrival, np.inf).min(axis = 1)
+
+    with np.errstate(invalid = "ignore", over = "ignore"):
+        advantage = np.clip((time_defence - time_attack) * np.pi / (np.sqrt(3) * sigma), -50, 50)
+    advantage = np.nan_to_num(advantage, nan = 0.0)
+
+    return 1 / (1 + np.exp(-advantage))
+
+
 def plot_polygon(ax, poly, **kwargs) -> PatchCollection:
     """Plots a Polygon to pyplot `ax`"""
     path = Path.make_compound_path(
@@ -172,9 +289,7 @@ def plot_pass(
 
     pitch.draw(ax = ax)
 
-    freeze_frame = pass_row["freeze_frame"]
-    if isinstance(freeze_frame, str):
-        freeze_frame = ast.literal_eval(freeze_frame)
+    start_location, end_location, freeze_frame = get_pass_geometry(pass_row)
 
     frame_df = pd.DataFrame.from_dict(freeze_frame)
     frame_df["x"] = frame_df["location"].map(lambda x : x[0])
@@ -188,16 +303,6 @@ def plot_pass(
         ax = ax
     )
 
-    try:
-        start_location = [pass_row["location_x"], pass_row["location_y"]]
-    except:
-        start_location = pass_row["location"]
-    if isinstance(start_location, str):
-        start_location = ast.literal_eval(start_location)
-    end_location = pass_row["pass_end_location"]
-    if isinstance(end_location, str):
-        end_location = ast.literal_eval(end_location)
-
     ax.arrow(
         start_location[0],
         start_location[1],
@@ -224,6 +329,227 @@ def plot_pass(
     return ax
 
 
+def get_pass_geometry(pass_row) -> tuple:
+    """Return the start location, end location and freeze frame of a pass,
+    parsed from their string representation if needed (with parse_freeze_frame
+    for the freeze frame, as this is called for every pass of a report)."""
+
+    try:
+        start_location = [pass_row["location_x"], pass_row["location_y"]]
+    except:
+        start_location = pass_row["location"]
+    start_location = return_as_list(start_location)
+    end_location = return_as_list(pass_row["pass_end_location"])
+    freeze_frame = parse_freeze_frame(pass_row["freeze_frame"])
+
+    return start_location, end_location, freeze_frame
+
+
+@lru_cache(maxsize = 8)
+def get_pitch_background(width: int = 360, height: int = 260) -> tuple:
+    """Draw an empty pitch once and return it as an image,
+    so that it can be reused for every pass plot.
+
+    Inputs:
+        width (int): The width of the image in pixels
+        height (int): The height of the image in pixels
+
+    Returns:
+        A tuple (image, extent), where image is a RGBA np.ndarray
+        and extent the (left, right, bottom, top) pitch coordinates of the image
+    """
+
+    pitch = Pitch(
+        pitch_type = "statsbomb",
+        pitch_color = "grass",
+        line_color = "white",
+        goal_type = "box",
+        stripe = True,
+        linewidth = 1,
+        pad_left = 2, pad_right = 2, pad_top = 2, pad_bottom = 2
+        )
+
+    fig = Figure(figsize = (width / 100, height / 100), dpi = 100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    pitch.draw(ax = ax)
+    ax.set_axis_off()
+    canvas.draw()
+
+    # Pitch.draw sets an equal aspect, so the axes box does not fill the figure:
+    # keep only the pixels of the axes box, which map exactly to the axes limits
+    image = np.asarray(canvas.buffer_rgba())
+    x0, y0, x1, y1 = np.round(ax.get_window_extent().extents).astype(int)
+    image = image[image.shape[0] - y1:image.shape[0] - y0, x0:x1].copy()
+    extent = (*ax.get_xlim(), *ax.get_ylim())
+
+    return image, extent
+
+
+def draw_pass(
+    ax, pass_row, background: tuple, corr_width: float = 2,
+    length: float = 50, alpha: float = 10, title: str = None):
+    """Draw a pass over a pitch background with lightweight matplotlib artists
+    (a scatter for the players, an arrow and a polygon for the reception shape).
+
+    Inputs:
+        ax (matplotlib.axes): a matplotlib axes
+        pass_row (pd.Series or dict): a pass (with a freeze frame)
+        background (tuple): the (image, extent) returned by get_pitch_background
+        corr_width (float): the with of the central corridor in yards
+        alpha (float): the angle of the reception shape in degrees
+        length (float): the length of the reception shape in yards
+        title (str): the title of the plot (default is None)
+
+    Returns:
+        A matplotlib axes
+    """
+
+    image, extent = background
+    ax.imshow(image, extent = extent, interpolation = "nearest")
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    ax.set_axis_off()
+
+    start_location, end_location, freeze_frame = get_pass_geometry(pass_row)
+
+    reception_shape = create_reception_shape(
+        x = start_location[0],
+        y = start_location[1],
+        corr_width = corr_width,
+        length = length,
+        alpha = alpha,
+        rotation_angle = pass_row["pass_angle"]
+    )
+    ax.add_patch(Polygon(
+        np.asarray(reception_shape.exterior.coords)[:, :2],
+        facecolor = "lightblue", alpha = 0.6, edgecolor = "none"))
+
+    locations = np.array([player["location"][:2] for player in freeze_frame], dtype = float).reshape(-1, 2)
+    colors = ["tab:orange" if player["teammate"] else "tab:blue" for player in freeze_frame]
+    ax.scatter(locations[:, 0], locations[:, 1], c = colors, s = 12, edgecolors = "white", linewidths = 0.3)
+
+    ax.annotate(
+        "", xy = end_location[:2], xytext = start_location[:2],
+        arrowprops = {"arrowstyle" : "-|>", "color" : "black", "lw" : 1}
+    )
+
+    if title:
+        ax.set_title(title, fontsize = 7)
+
+    return ax
+
+
+def _render_pass_page(args: tuple) -> bytes:
+    """Render a page of passes and return it as PNG bytes (runs in a worker process)."""
+
+    records, nrows, ncols, cell_size, dpi, shape_params = args
+
+    fig = Figure(figsize = (ncols * cell_size[0] / 100, nrows * cell_size[1] / 100), dpi = dpi)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows, ncols, squeeze = False).ravel()
+    background = get_pitch_background(*cell_size)
+
+    for ax, record in zip(axes, records):
+        draw_pass(ax, record, background, title = record.get("title"), **shape_params)
+    for ax in axes[len(records):]:
+        ax.set_axis_off()
+
+    fig.tight_layout(pad = 0.3)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format = "png", dpi = dpi)
+
+    return buffer.getvalue()
+
+
+def render_pass_pages(
+    passes_df: pd.DataFrame, nrows: int = 4, ncols: int = 4, title_col: str = None,
+    corr_width: float = 2, length: float = 50, alpha: float = 10,
+    cell_size: tuple = (360, 260), dpi: int = 100, n_jobs: int = None) -> list:
+    """Render many passes into grid pages, spreading the pages across worker processes.
+
+    Inputs:
+        passes_df (pd.DataFrame): the passes to plot (with a freeze frame column)
+        nrows (int): the number of rows of passes per page
+        ncols (int): the number of columns of passes per page
+        title_col (str): the column used as the title of each pass (default is None)
+        corr_width (float): the with of the central corridor in yards
+        alpha (float): the angle of the reception shape in degrees
+        length (float): the length of the reception shape in yards
+        cell_size (tuple): the (width, height) of each pass plot in pixels
+        dpi (int): the resolution of the pages
+        n_jobs (int): the number of worker processes. Default is None (one per CPU).
+            Set to 1 to render in the current process.
+
+    Returns:
+        A list of PNG images (bytes), one per page
+    """
+
+    columns = ["location_x", "location_y", "location", "pass_angle", "pass_end_location", "freeze_frame"]
+    records = passes_df[[col for col in columns if col in passes_df.columns]].to_dict("records")
+    if title_col:
+        for record, title in zip(records, passes_df[title_col].astype(str)):
+            record["title"] = title
+
+    shape_params = {"corr_width" : corr_width, "length" : length, "alpha" : alpha}
+    per_page = nrows * ncols
+    pages = [
+        (records[i:i + per_page], nrows, ncols, tuple(cell_size), dpi, shape_params)
+        for i in range(0, len(records), per_page)
+    ]
+
+    if n_jobs == 1:
+        return [_render_pass_page(page) for page in pages]
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        return list(executor.map(_render_pass_page, pages))
+
+
+def save_pass_pages(passes_df: pd.DataFrame, path_template: str = "passes_{:04d}.png", **kwargs) -> list:
+    """Render many passes into grid pages and save each page as a PNG file.
+
+    Inputs:
+        passes_df (pd.DataFrame): the passes to plot (with a freeze frame column)
+        path_template (str): the path of the pages, formatted with the page number
+        **kwargs: the parameters of render_pass_pages
+
+    Returns:
+        The list of the saved files
+    """
+
+    paths = []
+    for i, page in enumerate(render_pass_pages(passes_df, **kwargs)):
+        path = path_template.format(i)
+        with open(path, "wb") as f:
+            f.write(page)
+        paths.append(path)
+
+    return paths
+
+
+def save_pass_report(passes_df: pd.DataFrame, pdf_file: str, dpi: int = 100, **kwargs) -> str:
+    """Render many passes into a multipage PDF report.
+
+    Inputs:
+        passes_df (pd.DataFrame): the passes to plot (with a freeze frame column)
+        pdf_file (str): the path of the PDF file
+        dpi (int): the resolution of the pages
+        **kwargs: the parameters of render_pass_pages
+
+    Returns:
+        The path of the PDF file
+    """
+
+    with PdfPages(pdf_file) as pdf:
+        for page in render_pass_pages(passes_df, dpi = dpi, **kwargs):
+            image = plt.imread(io.BytesIO(page), format = "png")
+            fig = Figure(figsize = (image.shape[1] / dpi, image.shape[0] / dpi), dpi = dpi)
+            fig.figimage(image)
+            pdf.savefig(fig)
+
+    return pdf_file
+
+
 def return_as_list(el):
     """Takes a list or a list-typed string as an input
     and returns the list that match the input.